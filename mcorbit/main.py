@@ -63,10 +63,10 @@ import corner  # noqa
 import aplpy  # noqa
 
 from mcorbit import orbits  # noqa
-from mcorbit.model import ln_prob  # noqa
+from mcorbit.model import ln_prob, ln_prob_batch  # noqa
 from mcorbit import mcmc  # noqa
 
-np.set_printoptions(precision=5, threshold=np.inf)
+np.set_printoptions(precision=5)
 
 STAMP = ""  # datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 OUTPATH = os.path.join(os.path.dirname(__file__), '..', 'out')
@@ -172,9 +172,7 @@ def ppv_pts(cube):
     c = c.ravel()
 
     # convert to numpy array and remove nan velocities
-    data_pts = np.array([c.ra.rad,
-                         c.dec.rad,
-                         c.radial_velocity.value]).T
+    data_pts = orbits.coords_to_ppv(c)
 
     # strip out anything that's not an actual data point
     data_pts = data_pts[_notnan(data_pts[:, 2])]
@@ -518,28 +516,23 @@ def main(pool, args):
     print("Preparing data...")
     data = ppv_pts(masked_hnc3_2_cube)
 
+    # find the lower bounds on the peri and apoapses using apparent sep.
+    # this uses the full set of ppv points, so it is done before any
+    # subsampling, and reuses them rather than rebuilding the moment 1 map
+    gc_pos = np.array([GAL_CENTER.ra.rad, GAL_CENTER.dec.rad])
+    offset = (data[:, :2] - gc_pos) * D_SGR_A.to(u.pc).value
+    sep = np.sqrt(np.sum(offset ** 2, axis=1))
+
     if args.SUB != 1.:
         n_pts = len(data)
         ind = np.random.choice(range(n_pts), size=int(args.SUB * n_pts),
                                replace=False)
         data = data[ind]
 
-    # find the lower bounds on the peri and apoapses using apparent sep
-    m1 = masked_hnc3_2_cube.moment1()
-    dd, rr = m1.spatial_coordinate_map
-    c = SkyCoord(ra=rr, dec=dd, radial_velocity=m1, frame='fk5')
-    c = c.ravel()
-
-    offset = np.array([((c.ra - GAL_CENTER.ra).rad * D_SGR_A).to(u.pc),
-                       ((c.dec - GAL_CENTER.dec).rad * D_SGR_A).to(u.pc),
-                       c.radial_velocity.to(u.pc / u.yr).value]).T
-
-    offset = offset[_notnan(offset[:, 2])]
-
     # use lower bounds on peri/apoapsis to set lower bound on angular
     # momentum
-    r_p_lb = np.min(np.sqrt(offset[:, 0] ** 2 + offset[:, 1] ** 2))
-    r_a_lb = np.max(np.sqrt(offset[:, 0] ** 2 + offset[:, 1] ** 2))
+    r_p_lb = np.min(sep)
+    r_a_lb = np.max(sep)
     lmin = (r_p_lb * r_a_lb * np.sqrt((2 * (orbits.potential(r_a_lb)
                                             - orbits.potential(r_p_lb)))
             / ((r_a_lb ** 2) - (r_p_lb ** 2))))
@@ -566,9 +559,14 @@ def main(pool, args):
                        p_l], dtype=np.float64)
     np.savetxt(os.path.join(OUTPATH, STAMP, 'pspace.csv'), pspace)
 
-    samples = mcmc.fit_orbits(pool, ln_prob, data, pspace,
+    # the likelihood only runs in parallel when the walkers aren't already
+    # spread over several processes
+    lnprob = ln_prob_batch if args.VECTORIZE else ln_prob
+    parallel = args.VECTORIZE or (not args.MPI and args.NCORES == 1)
+    samples = mcmc.fit_orbits(pool, lnprob, data, pspace,
                               nwalkers=args.WALKERS, nmax=args.NMAX,
                               burn=args.BURN, reset=False, mpi=args.MPI,
+                              vectorize=args.VECTORIZE, parallel=parallel,
                               outpath=os.path.join(OUTPATH, STAMP))
 
     # analyze the walker data
@@ -625,6 +623,9 @@ if __name__ == '__main__':
                        "(uses multiprocessing).")
     GROUP.add_argument("--mpi", dest="MPI", default=False,
                        action="store_true", help="Run with MPI.")
+    GROUP.add_argument("--vectorize", dest="VECTORIZE", default=False,
+                       action="store_true", help="Evaluate all walkers in a "
+                       "single process with one call per step.")
     args = PARSER.parse_args()
 
     pool = schwimmbad.choose_pool(mpi=args.MPI, processes=args.NCORES)
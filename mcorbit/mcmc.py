@@ -36,9 +36,12 @@ import numpy as np
 import emcee
 from emcee.autocorr import AutocorrError
 
+from mcorbit.model import whitening, prepare_data
+
 
 def fit_orbits(pool, lnlike, data, pspace, nwalkers=500, nmax=10000, burn=1000,
-               reset=True, mpi=False, outpath=None):
+               reset=True, mpi=False, vectorize=False, parallel=False,
+               outpath=None):
     """Uses MCMC to explore the parameter space specified by `priors`.
 
     Uses MCMC to fit orbits to the given `data`, exploring the parameter space
@@ -76,6 +79,15 @@ def fit_orbits(pool, lnlike, data, pspace, nwalkers=500, nmax=10000, burn=1000,
         sampling will start from scratch. If False, the sampler will load it's
         last recorded state, and continue sampling the space from there.
         Default is True.
+    vectorize : bool, optional
+        If True, `lnlike` is called once per step with the positions of all
+        walkers (see :func:`mcorbit.model.ln_prob_batch`), and `pool` is not
+        used to distribute walkers. Default is False.
+    parallel : bool, optional
+        If True, each likelihood evaluation is itself run in parallel over
+        the data points. This oversubscribes the cores when `pool` already
+        spreads walkers over several processes, so it should only be used
+        with a single process. Default is False.
 
     Returns
     -------
@@ -96,7 +108,8 @@ def fit_orbits(pool, lnlike, data, pspace, nwalkers=500, nmax=10000, burn=1000,
     pos_max = pspace[:, 1]
     prange = pos_max - pos_min
     pos = [pos_min + prange * np.random.rand(ndim) for i in range(nwalkers)]
-    cov = np.cov(data, rowvar=False)
+    whiten, log_norm = whitening(np.cov(data, rowvar=False))
+    data = prepare_data(data, whiten)
 
     # Set up backe end for walker position saving
     # note that this requires h5py and emcee 3.x
@@ -111,7 +124,10 @@ def fit_orbits(pool, lnlike, data, pspace, nwalkers=500, nmax=10000, burn=1000,
             sys.exit(0)
 
         sampler = emcee.EnsembleSampler(nwalkers, ndim, lnlike,
-                                        args=[data, pspace, cov], pool=pool,
+                                        args=[data, pspace, whiten, log_norm],
+                                        kwargs={'parallel': parallel},
+                                        pool=None if vectorize else pool,
+                                        vectorize=vectorize,
                                         backend=backend)
 
         # initial burn-in. this appears to be necessary to avoid
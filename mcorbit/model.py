@@ -23,28 +23,215 @@ Created on Fri Feb  9 16:08:27 2018
 @author: jacaseyclyde
 """
 import numpy as np
-from scipy.stats import multivariate_normal
 from scipy.optimize import brentq
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
 from mcorbit import orbits
 
+# the likelihood works in single precision on whitened ppv points. points
+# are shifted to be relative to Sgr A* before they are transformed and cast,
+# so that separations between data and model points do not lose precision to
+# the large absolute ra and dec
+PPV_ORIGIN = np.array([orbits.GAL_CENTER.ra.rad,
+                       orbits.GAL_CENTER.dec.rad,
+                       0.])
 
-def ln_like(data, model, cov):
-    """Calculates the ln probability of a dataset generating from a model.
 
-    Calculates the probability that the dataset associated with instances
-    of this class could have been generated by an orbital model defined by
-    the set of parameters `theta`, without any prior knowledge of the
-    parameter space.
+def prepare_data(data, whiten):
+    """Converts ppv data points to the form used by the likelihood.
 
     Parameters
     ----------
-    theta : :obj:`numpy.ndarray`
-        An array of orbital parameters in the form::
+    data : :obj:`numpy.ndarray`
+        An array of ppv data points, with shape (n_data, 3).
+    whiten : :obj:`numpy.ndarray`
+        The whitening transform of the data, as returned by
+        :func:`whitening`.
+
+    Returns
+    -------
+    :obj:`numpy.ndarray`
+        A c-contiguous, single precision copy of `data`, relative to
+        :data:`PPV_ORIGIN` and whitened by `whiten`.
+
+    """
+    return _whiten(data, whiten, np.float32)
+
+
+def _whiten(pts, whiten, dtype):
+    """
+    Shifts ppv points to be relative to :data:`PPV_ORIGIN`, whitens them, and
+    casts them to `dtype`, into a new c-contiguous array.
+    """
+    # the transform is done in the precision of `pts`, and only the result
+    # is cast
+    out = np.empty(pts.shape, dtype=dtype)
+    np.matmul(pts - PPV_ORIGIN, whiten.T, out=out, casting='same_kind')
+    return out
+
 
-            numpy.array([aop, loan, inc, r_per, r_ap])
+def whitening(cov):
+    """Finds the transform that whitens the data for use in the likelihood.
 
-        which define the orbital model to check probabilities for.
+    The covariance matrix is fixed for the duration of a fit, so rather
+    than applying its inverse to every data/model separation, the data are
+    transformed once to have unit covariance, and model points are given
+    the same transform as they are generated. The gaussian density of a
+    separation then only depends on its squared length.
+
+    Parameters
+    ----------
+    cov : :obj:`numpy.ndarray`
+        The covariance matrix of the data.
+
+    Returns
+    -------
+    whiten : :obj:`numpy.ndarray`
+        The inverse of the lower triangular cholesky factor of `cov`.
+    log_norm : float
+        The natural log of the normalization of a gaussian with
+        covariance `cov`.
+
+    Raises
+    ------
+    ValueError
+        If `cov` is singular, in which case the data do not constrain every
+        axis of ppv space.
+
+    Notes
+    -----
+    The full covariance is used on every axis. The position variances of
+    ppv data are many orders of magnitude smaller than the velocity
+    variance, and a pseudo-inverse (as with ``allow_singular=True`` in
+    :obj:`scipy.stats.multivariate_normal`) treats them as zero, leaving a
+    likelihood that only depends on velocity.
+
+    """
+    ndim = len(cov)
+    try:
+        chol = np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        raise ValueError("data covariance is singular: {0}".format(cov))
+    whiten = np.linalg.inv(chol)
+    log_norm = (-0.5 * ndim * np.log(2 * np.pi)
+                - np.sum(np.log(np.diag(chol))))
+    return whiten, log_norm
+
+
+def _ln_sum_pdf(data, model, log_norm, block=(256, 128)):
+    """
+    Log of the summed gaussian density of each whitened data pt over all
+    whitened model pts.
+
+    The (data, model) grid is evaluated in tiles of `block` points so the
+    separations stay in cache, with a running logsumexp over model tiles.
+    """
+    n_data, ndim = data.shape
+    out = np.empty(n_data)
+
+    for i0 in range(0, n_data, block[0]):
+        data_blk = data[i0:i0 + block[0]]
+        # the running shift is -inf until a row has a finite density, so
+        # its empty partial sum is scaled to zero rather than by exp(-shift)
+        row_max = np.full(len(data_blk), -np.inf)
+        row_shift = np.full(len(data_blk), -np.inf)
+        row_sum = np.zeros(len(data_blk))
+
+        for j0 in range(0, len(model), block[1]):
+            model_blk = model[j0:j0 + block[1]]
+
+            # the points are whitened, so the quadratic form is the squared
+            # length of each separation
+            diff = (data_blk[:, None, :]
+                    - model_blk[None, :, :]).reshape(-1, ndim)
+            quad = np.einsum('ij,ij->i', diff, diff)
+            ln_pdf = -0.5 * quad.reshape(len(data_blk), len(model_blk))
+
+            # rescale the partial sums to the new running maximum. rows
+            # with no finite density yet are left unshifted, as in
+            # scipy.special.logsumexp
+            row_max = np.maximum(row_max, np.max(ln_pdf, axis=1))
+            shift = np.where(np.isfinite(row_max), row_max, 0.)
+            row_sum = (row_sum * np.exp(row_shift - shift)
+                       + np.sum(np.exp(ln_pdf - shift[:, None]), axis=1))
+            row_shift = np.where(np.isfinite(row_max), row_max, -np.inf)
+
+        # this suppresses a runtime warning we expect for log(0)
+        with np.errstate(divide='ignore'):
+            out[i0:i0 + block[0]] = row_shift + np.log(row_sum) + log_norm
+
+    return out
+
+
+def _ln_sum_pdf3(data, model, log_norm):
+    """
+    Specialization of :func:`_ln_sum_pdf` for 3D points, compiled with numba
+    when it is available.
+    """
+    n_data, n_model = data.shape[0], model.shape[0]
+
+    out = np.empty(n_data)
+    for i in prange(n_data):
+        # running logsumexp over the model pts, rescaling the partial sum
+        # whenever a new maximum is found
+        row_max = -np.inf
+        row_sum = 0.
+        for j in range(n_model):
+            dx = data[i, 0] - model[j, 0]
+            dy = data[i, 1] - model[j, 1]
+            dz = data[i, 2] - model[j, 2]
+            lp = -0.5 * (dx * dx + dy * dy + dz * dz)
+
+            if lp > row_max:
+                row_sum = row_sum * np.exp(row_max - lp) + 1.
+                row_max = lp
+            elif row_max > -np.inf:
+                row_sum += np.exp(lp - row_max)
+
+        out[i] = row_max + np.log(row_sum) + log_norm
+
+    return out
+
+
+if njit is not None:
+    # infinite separations are meaningful here, so the fastmath flags that
+    # assume finite values (nnan, ninf) are left out. numba's on-disk cache
+    # doesn't distinguish builds of the same function with and without
+    # parallel=True, so only the serial build is cached
+    _FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+    _ln_sum_pdf3_serial = njit(cache=True, fastmath=_FASTMATH)(_ln_sum_pdf3)
+    _ln_sum_pdf3 = njit(parallel=True, fastmath=_FASTMATH)(_ln_sum_pdf3)
+
+
+def ln_like(data, model, whiten, log_norm, model_stride=2, parallel=True):
+    """Calculates the ln probability of a dataset generating from a model.
+
+    Calculates the probability that the dataset could have been generated
+    by the given orbital model, without any prior knowledge of the
+    parameter space.
+
+    Parameters
+    ----------
+    data : :obj:`numpy.ndarray`
+        An array of ppv data points, with shape (n_data, 3), as returned by
+        :func:`prepare_data`.
+    model : :obj:`numpy.ndarray`
+        An array of ppv model points, with shape (n_model, 3).
+    whiten, log_norm
+        The whitening transform and gaussian normalization of the data, as
+        returned by :func:`whitening`.
+    model_stride : int, optional
+        Only every `model_stride` th model point is used, trading model
+        resolution for computation time. Default is 2.
+    parallel : bool, optional
+        If True, the numba kernel runs in parallel over data points. This
+        should be False when several likelihoods are already being evaluated
+        at once. Default is True.
 
     Returns
     -------
@@ -53,27 +240,29 @@ def ln_like(data, model, cov):
         generated by the given model.
 
     """
-    # initializing a vector of probabilities for each point in data.
     # the basic idea here is that for each data point, it's probability
     # of being generated by the model is an integral over the entire
     # entire model, or in this case a sum of the discretized model
     # points. the log likelihood is then a sum of the natural logs of
     # all data points.
-    prob = np.zeros(len(data))
 
     # first we sum the model prob for each data pt over all model pts
-    # taking every other model point to improve computation time
-    model = model[::2,:]
-    for model_pt in model:
-        prob += multivariate_normal.pdf(data, mean=model_pt, cov=cov,
-                                        allow_singular=True)
-
-    # normalize over the number of points in the model.
-    prob /= len(model)
+    # thinning the model points to improve computation time. the thinned
+    # points are moved to the whitened frame of the data, and copied so the
+    # kernels read contiguous rows. the densities are summed in double
+    # precision
+    model = _whiten(model[::model_stride, :], whiten, data.dtype)
+    if njit is not None and data.shape[1] == 3:
+        if parallel:
+            ln_sum = _ln_sum_pdf3(data, model, log_norm)
+        else:
+            ln_sum = _ln_sum_pdf3_serial(data, model, log_norm)
+    else:
+        ln_sum = _ln_sum_pdf(data, model, log_norm)
 
-    # this suppresses a runtime warning we expect for log(0)
-    with np.errstate(divide='ignore'):
-        return np.sum(np.log(prob))
+    # normalizing over the number of points in the model is the same shift
+    # for every data pt, so it is applied once to the total
+    return np.sum(ln_sum) - len(data) * np.log(len(model))
 
 
 def ln_prior(theta, space):
@@ -104,15 +293,15 @@ def ln_prior(theta, space):
 
     """
     # first check that all parameters are within our parameter space
-    prior = 1.
-    for i in range(space.shape[0]):
-        pmin = min(space[i])
-        pmax = max(space[i])
+    pmin = np.min(space, axis=1)
+    pmax = np.max(space, axis=1)
+    if np.any(theta < pmin) or np.any(theta > pmax):
+        return -np.inf
 
-        if theta[i] < pmin or theta[i] > pmax:
-            return -np.inf
-        else:
-            prior *= (1. / (pmax - pmin))
+    # we can also constrain the orbits such that r0 is the periapsis. this
+    # is a single evaluation, so it is checked before root finding
+    if orbits.V_eff_grad(theta[-2], theta[-1]) > 0.:
+        return -np.inf
 
     # constraint on the radius to make sure we aren't past our maximum
     # bound orbit for a given angular momentum
@@ -120,21 +309,19 @@ def ln_prior(theta, space):
     if theta[-2] >= rmax:
         return -np.inf
 
-    # we can also constrain the orbits such that r0 is the periapsis
-    if orbits.V_eff_grad(theta[-2], theta[-1]) > 0.:
-        return -np.inf
-
     # next check that orbits are bounded
     V0 = orbits.V_eff(theta[-2], theta[-1])
 
-    if (V0 > orbits.V_eff(min(space[-2]), theta[-1])
+    if (V0 > orbits.V_eff(pmin[-2], theta[-1])
        or V0 > orbits.V_eff(rmax, theta[-1])):
         return -np.inf
 
-    return np.log(prior)
+    # flat prior over the volume of the parameter space
+    return -np.sum(np.log(pmax - pmin))
 
 
-def ln_prob(theta, data, space, cov):
+def ln_prob(theta, data, space, whiten, log_norm, model_stride=2,
+            parallel=True):
     """Calculates P(data|model)
 
     Calculates the natural log of the Bayesian probability that the
@@ -146,6 +333,18 @@ def ln_prob(theta, data, space, cov):
     theta : (aop, loan, inc, r_per, r_ap)
         A tuple of orbital parameters which define the orbital
         model being evaluated.
+    data : :obj:`numpy.ndarray`
+        An array of ppv data points, as returned by :func:`prepare_data`.
+    space : :obj:`numpy.ndarray`
+        The bounds of the parameter space.
+    whiten, log_norm
+        The whitening transform and gaussian normalization of the data, as
+        returned by :func:`whitening`.
+    model_stride : int, optional
+        Passed to :func:`ln_like`. Default is 2.
+    parallel : bool, optional
+        Passed to :func:`ln_like`. Should be False when walkers are spread
+        over several processes. Default is True.
 
     Returns
     -------
@@ -161,12 +360,66 @@ def ln_prob(theta, data, space, cov):
     lnprior = ln_prior(theta, space)
     if not np.isfinite(lnprior):
         return -np.inf, -np.inf
-    lnlike = ln_like(data, orbits.model(theta), cov)
+    lnlike = ln_like(data, orbits.model(theta), whiten, log_norm,
+                     model_stride=model_stride, parallel=parallel)
     if not np.isfinite(lnlike):
         return lnprior, -np.inf
     return lnprior + lnlike, lnprior
 
 
+def ln_prob_batch(thetas, data, space, whiten, log_norm, model_stride=2,
+                  parallel=True):
+    """Calculates P(data|model) for every walker in an ensemble at once.
+
+    Vectorized form of :func:`ln_prob`, for use with an
+    :obj:`emcee.EnsembleSampler` created with ``vectorize=True``. Walkers
+    outside of the parameter space are rejected together before any
+    orbits are generated, and the orbits of the remaining walkers are
+    generated as one batch (see :func:`orbits.models`).
+
+    Parameters
+    ----------
+    thetas : :obj:`numpy.ndarray`
+        An array of orbital parameters with shape (nwalkers, ndim), with
+        each row in the form taken by :func:`ln_prob`.
+    data, space, whiten, log_norm, model_stride, parallel
+        See :func:`ln_prob`.
+
+    Returns
+    -------
+    :obj:`numpy.ndarray`
+        An array with shape (nwalkers, 2), where each row holds the log
+        probability and log prior of a walker, as returned by
+        :func:`ln_prob`.
+
+    """
+    thetas = np.atleast_2d(thetas)
+    lnprobs = np.full((len(thetas), 2), -np.inf)
+
+    pmin = np.min(space, axis=1)
+    pmax = np.max(space, axis=1)
+    inbounds = np.all((thetas >= pmin) & (thetas <= pmax), axis=1)
+
+    # check the full prior of the remaining walkers, then generate the
+    # models of those that pass in a single batch
+    accepted = []
+    for i in np.flatnonzero(inbounds):
+        lnprior = ln_prior(thetas[i], space)
+        if np.isfinite(lnprior):
+            lnprobs[i] = -np.inf, lnprior
+            accepted.append(i)
+
+    for i, ppv in zip(accepted, orbits.models(thetas[accepted])):
+        lnlike = ln_like(data, ppv, whiten, log_norm,
+                         model_stride=model_stride, parallel=parallel)
+        if not np.isfinite(lnlike):
+            lnprobs[i] = lnprobs[i, 1], -np.inf
+        else:
+            lnprobs[i, 0] = lnprobs[i, 1] + lnlike
+
+    return lnprobs
+
+
 if __name__ == '__main__':
     # code profiling tasks
     # create theta
@@ -202,9 +455,7 @@ if __name__ == '__main__':
     c = c.ravel()
 
     # convert to numpy array and remove nan velocities
-    data_pts = np.array([c.ra.rad,
-                         c.dec.rad,
-                         c.radial_velocity.value]).T
+    data_pts = orbits.coords_to_ppv(c)
 
     # strip out anything that's not an actual data point
     nonnan = ~np.isnan(data_pts[:, 2])
@@ -213,4 +464,5 @@ if __name__ == '__main__':
     # covaraince matrix
     cov = np.cov(data, rowvar=False)
 
-    ln_like(data, orbits.model(theta), cov)
+    whiten, log_norm = whitening(cov)
+    ln_like(prepare_data(data, whiten), orbits.model(theta), whiten, log_norm)
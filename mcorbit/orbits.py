@@ -63,6 +63,10 @@ G = (G.to((u.pc ** 3) / (u.Msun * u.yr ** 2))).value
 
 D_SGR_A = 8.127 * u.kpc
 
+# conversion factor for velocities, kept as a plain float so the orbit
+# generation path does no unit arithmetic
+PCYR_TO_KMS = (u.pc / u.yr).to(u.km / u.s)
+
 # =============================================================================
 # Default data
 # =============================================================================
@@ -395,17 +399,19 @@ def orbit(r0, l_cons):
 
     # sticking to 2D polar for initial integration since z = 0
     # leaving reminders of the units, but doing calculaions without
-    # them to improve efficiency. Units will return at end
+    # them to improve efficiency. Units will return at end.
+    # steps are collected in lists and converted to arrays once at the
+    # end, since appending to an array copies it on every step
 #    r0 *= u.pc
-    r_pos = np.array([r0], dtype=np.float64)  # * u.pc
-    r_vel = np.array([0.], dtype=np.float64)  # * u.pc / u.yr
+    r_pos = [r0]  # * u.pc
+    r_vel = [0.]  # * u.pc / u.yr
 
-    ang_pos = np.array([0.], dtype=np.float64)  # * u.rad
+    ang_pos = [0.]  # * u.rad
 
 #    l_cons *= (u.pc ** 2) / u.yr
 
     ang_v0 = l_cons / (r0 ** 2)  # * u.rad
-    ang_vel = np.array([ang_v0], dtype=np.float64)  # * u.rad / u.yr
+    ang_vel = [ang_v0]  # * u.rad / u.yr
 
     while ang_pos[-1] < 2. * np.pi:  # * u.rad:
         # radial portion first
@@ -437,15 +443,17 @@ def orbit(r0, l_cons):
 
         # second drift
         r_new = r_half + 0.5 * TSTEP * r_vel_new
-        r_pos = np.append(r_pos, r_new)  # * u.pc
-        r_vel = np.append(r_vel, r_vel_new)  # * u.pc / u.yr
+        r_pos.append(r_new)  # * u.pc
+        r_vel.append(r_vel_new)  # * u.pc / u.yr
 
         ang_new = ang_half + 0.5 * TSTEP * ang_vel_new
-        ang_pos = np.append(ang_pos, ang_new)  # * u.rad
-        ang_vel = np.append(ang_vel, ang_vel_new)  # * u.rad / u.yr
+        ang_pos.append(ang_new)  # * u.rad
+        ang_vel.append(ang_vel_new)  # * u.rad / u.yr
 
-    return (r_pos * u.pc, r_vel * u.pc / u.yr,
-            ang_pos * u.rad, ang_vel * u.rad / u.yr)
+    return (np.array(r_pos, dtype=np.float64) * u.pc,
+            np.array(r_vel, dtype=np.float64) * u.pc / u.yr,
+            np.array(ang_pos, dtype=np.float64) * u.rad,
+            np.array(ang_vel, dtype=np.float64) * u.rad / u.yr)
 
 
 # =============================================================================
@@ -480,17 +488,23 @@ def polar_to_cartesian(r_pos, r_vel, ang_pos, ang_vel):
         coordinates.
 
     """
-    pos = np.array([r_pos * np.cos(ang_pos),
-                    r_pos * np.sin(ang_pos),
-                    [0.] * len(r_pos)])
-
-    vel = np.array([(r_vel * np.cos(ang_pos)
-                    - r_pos * ang_vel * np.sin(ang_pos)
-                    / u.rad).to(u.km / u.s),
-                    (r_vel * np.sin(ang_pos)
-                    + r_pos * ang_vel * np.cos(ang_pos)
-                    / u.rad).to(u.km / u.s),
-                    [0.] * len(r_vel)])
+    # strip units once up front (assuming pc, yr and rad where none are
+    # given), then work with plain arrays
+    r_pos = u.Quantity(r_pos, u.pc).value
+    r_vel = u.Quantity(r_vel, u.pc / u.yr).value
+    ang_pos = u.Quantity(ang_pos, u.rad).value
+    ang_vel = u.Quantity(ang_vel, u.rad / u.yr).value
+
+    c_ang, s_ang = np.cos(ang_pos), np.sin(ang_pos)
+    zeros = np.zeros(len(r_pos))
+
+    pos = np.array([r_pos * c_ang,
+                    r_pos * s_ang,
+                    zeros])
+
+    vel = PCYR_TO_KMS * np.array([r_vel * c_ang - r_pos * ang_vel * s_ang,
+                                  r_vel * s_ang + r_pos * ang_vel * c_ang,
+                                  zeros])
 
     return pos, vel
 
@@ -581,6 +595,48 @@ def sky_coords(pos, vel):
 # =============================================================================
 # The model function
 # =============================================================================
+def _rotated_orbit(theta):
+    """
+    Integrates the orbit defined by `theta` and rotates it into
+    galactocentric coordinates.
+    """
+    aop, loan, inc, r0, l_cons = theta
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error')
+        try:
+            pos, vel = polar_to_cartesian(*orbit(r0, l_cons))
+        except Warning:
+            raise ValueError("orbits params: {0}, {1}".format(theta[-2],
+                             theta[-1]))
+    return orbit_rotator(pos, vel, aop, loan, inc)
+
+
+def coords_to_ppv(c):
+    """Converts sky coordinates to ppv points.
+
+    Parameters
+    ----------
+    c : :obj:`astropy.coordinates.SkyCoord` or frame
+        Sky coordinates with radial velocities, such as those returned by
+        :func:`sky_coords`.
+
+    Returns
+    -------
+    :obj:`numpy.ndarray`
+        A c-contiguous array of ppv points, with shape (len(c), 3). Each
+        point is of the form [ra, dec, vel], with ra and dec in radians and
+        vel in km/s.
+
+    """
+    # fill the columns of a c-contiguous array directly, rather than
+    # stacking and transposing, so the likelihood reads whole rows
+    ppv = np.empty((len(c), 3))
+    ppv[:, 0] = c.ra.rad
+    ppv[:, 1] = c.dec.rad
+    ppv[:, 2] = c.radial_velocity.value
+    return ppv
+
+
 def model(theta, coords=False):
     """Model generator.
 
@@ -592,20 +648,39 @@ def model(theta, coords=False):
     theta : (aop, loan, inc, r_per, r_ap)
 
     """
-    aop, loan, inc, r0, l_cons = theta
-    with warnings.catch_warnings():
-        warnings.filterwarnings('error')
-        try:
-            pos, vel = polar_to_cartesian(*orbit(r0, l_cons))
-        except Warning:
-            raise ValueError("orbits params: {0}, {1}".format(theta[-2],
-                             theta[-1]))
-    pos, vel = orbit_rotator(pos, vel, aop, loan, inc)
-    c = sky_coords(pos, vel)
+    c = sky_coords(*_rotated_orbit(theta))
     if coords:
         return c
-    return np.array([c.ra.rad, c.dec.rad,
-                     c.radial_velocity.value]).T
+    return coords_to_ppv(c)
+
+
+def models(thetas):
+    """Batch model generator.
+
+    Generates the model orbits for several sets of parameters at once.
+    The orbits are transformed to sky coordinates together, so the
+    overhead of building and transforming astropy coordinates is paid once
+    per batch rather than once per orbit.
+
+    Parameters
+    ----------
+    thetas : iterable of (aop, loan, inc, r_per, r_ap)
+
+    Returns
+    -------
+    list of :obj:`numpy.ndarray`
+        The ppv points of each orbit, as returned by :func:`model`.
+
+    """
+    rotated = [_rotated_orbit(theta) for theta in thetas]
+    if not rotated:
+        return []
+
+    pos = np.concatenate([r_pos for r_pos, _ in rotated], axis=1)
+    vel = np.concatenate([r_vel for _, r_vel in rotated], axis=1)
+    splits = np.cumsum([r_pos.shape[1] for r_pos, _ in rotated])[:-1]
+
+    return np.split(coords_to_ppv(sky_coords(pos, vel)), splits)
 
 
 # =============================================================================
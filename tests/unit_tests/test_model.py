@@ -5,7 +5,10 @@ Created on Wed Aug 22 13:32:12 2018
 
 @author: jacaseyclyde
 """
+import pytest
 import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import multivariate_normal
 
 from mcorbit import model
 
@@ -121,3 +124,191 @@ class TestLnPrior(object):
         ln_prior = self.model.ln_prior(params)
 
         assert ln_prior == -np.inf
+
+
+class TestLnLikeFunction(object):
+    """
+    Test the vectorized log likelihood against a direct scipy evaluation.
+    """
+    def setup_method(self):
+        # ppv points clustered about Sgr A*, where single precision alone
+        # could not resolve their separations
+        self.data = model.PPV_ORIGIN + 1e-4 * np.random.rand(10, 3)
+        self.orbit = model.PPV_ORIGIN + 1e-4 * np.random.rand(8, 3)
+        self.cov = np.cov(self.data, rowvar=False)
+
+    def test_reference(self):
+        """
+        Tests the batched log likelihood against a loop over model points
+        """
+        model_pts = self.orbit[::2]
+        prob = np.zeros(len(self.data))
+        for model_pt in model_pts:
+            prob += multivariate_normal.pdf(self.data, mean=model_pt,
+                                            cov=self.cov)
+        expected = np.sum(np.log(prob / len(model_pts)))
+
+        whiten, log_norm = model.whitening(self.cov)
+        lnlike = model.ln_like(model.prepare_data(self.data, whiten),
+                               self.orbit, whiten, log_norm)
+        np.testing.assert_allclose(lnlike, expected, rtol=1e-5)
+
+    def test_ppv_reference(self):
+        """
+        Tests the log likelihood on ppv-like data, whose covariance is too
+        ill-conditioned for scipy to treat as full rank
+        """
+        data = model.PPV_ORIGIN + np.random.rand(50, 3) * [1e-4, 1e-4, 1e2]
+        orbit = model.PPV_ORIGIN + np.random.rand(20, 3) * [1e-4, 1e-4, 1e2]
+        cov = np.cov(data, rowvar=False)
+
+        # exact double precision evaluation over every axis
+        diff = data[:, None, :] - orbit[None, ::2, :]
+        quad = np.einsum('ijk,kl,ijl->ij', diff, np.linalg.inv(cov), diff)
+        ln_pdf = -0.5 * (quad + 3 * np.log(2 * np.pi)
+                         + np.linalg.slogdet(cov)[1])
+        expected = np.sum(logsumexp(ln_pdf, axis=1) - np.log(10))
+
+        whiten, log_norm = model.whitening(cov)
+        lnlike = model.ln_like(model.prepare_data(data, whiten), orbit,
+                               whiten, log_norm)
+        np.testing.assert_allclose(lnlike, expected, rtol=1e-5)
+
+    def test_singular(self):
+        """
+        Tests that a singular data covariance is reported
+        """
+        cov = np.cov(self.data, rowvar=False)
+        cov[:, 2] = cov[2, :] = 0.
+        with pytest.raises(ValueError):
+            model.whitening(cov)
+
+    def test_stride(self):
+        """
+        Tests that a unit stride uses every model point
+        """
+        whiten, log_norm = model.whitening(self.cov)
+        data = model.prepare_data(self.data, whiten)
+        lnlike = model.ln_like(data, self.orbit, whiten, log_norm,
+                               model_stride=1)
+        expected = (np.sum(model._ln_sum_pdf(data,
+                                             model.prepare_data(self.orbit,
+                                                                whiten),
+                                             log_norm))
+                    - len(self.data) * np.log(len(self.orbit)))
+        np.testing.assert_allclose(lnlike, expected, rtol=1e-5)
+
+    def test_blocks(self):
+        """
+        Tests that tiling the batched kernel does not change the result
+        """
+        np.testing.assert_allclose(model._ln_sum_pdf(self.data, self.orbit,
+                                                     0., block=(3, 2)),
+                                   model._ln_sum_pdf(self.data, self.orbit,
+                                                     0.))
+
+    def test_blocks_far(self):
+        """
+        Tests the tiled kernel where every density underflows to zero
+        """
+        data = np.random.rand(10, 3)
+        orbit = np.random.rand(8, 3) + 40.
+        quad = np.sum((data[:, None, :] - orbit[None, :, :]) ** 2, axis=2)
+        expected = logsumexp(-0.5 * quad, axis=1)
+        for block in [(3, 2), (256, 128)]:
+            np.testing.assert_allclose(model._ln_sum_pdf(data, orbit, 0.,
+                                                         block=block),
+                                       expected)
+
+        # an infinitely distant first tile, followed by a finite tile that
+        # still underflows
+        data = np.zeros((2, 3))
+        orbit = np.array([[np.inf, 0., 0.], [50., 0., 0.]])
+        np.testing.assert_allclose(model._ln_sum_pdf(data, orbit, 0.,
+                                                     block=(2, 1)),
+                                   model._ln_sum_pdf3(data, orbit, 0.))
+        np.testing.assert_allclose(model._ln_sum_pdf(data, orbit, 0.,
+                                                     block=(2, 1)),
+                                   [-1250., -1250.])
+
+    def test_kernel(self):
+        """
+        Tests the specialized 3D kernels against the general batched kernel
+        """
+        expected = model._ln_sum_pdf(self.data, self.orbit, 0.)
+        np.testing.assert_allclose(model._ln_sum_pdf3(self.data, self.orbit,
+                                                      0.), expected)
+        if model.njit is not None:
+            np.testing.assert_allclose(
+                model._ln_sum_pdf3_serial(self.data, self.orbit, 0.),
+                expected)
+
+
+class TestLnPriorFunction(object):
+    """
+    Test the parameter space bounds of the log prior
+    """
+
+    def setup_method(self):
+        self.pspace = np.array([[-1., 1.],
+                                [-1., 1.],
+                                [-1., 1.],
+                                [-1., 1.],
+                                [-1., 1.]])
+
+    def test_unbound(self):
+        params = np.random.rand(5)
+        params[np.random.randint(5)] += 2.
+
+        assert model.ln_prior(params, self.pspace) == -np.inf
+
+    def test_batch_unbound(self):
+        params = np.random.rand(4, 5)
+        params[:, np.random.randint(5)] += 2.
+        lnprobs = model.ln_prob_batch(params, np.random.rand(10, 3),
+                                      self.pspace, np.eye(3), 0.)
+
+        assert lnprobs.shape == (4, 2)
+        assert np.all(lnprobs == -np.inf)
+
+    def test_batch_ln_prob(self, monkeypatch):
+        """
+        Tests that the batched log probability matches a loop over walkers
+        """
+        def fake_model(theta):
+            # walkers with a negative aop get an orbit so far from the data
+            # that they have no finite likelihood
+            if theta[0] < 0.:
+                return np.full((8, 3), 1e30)
+            return model.PPV_ORIGIN + 1e-4 * np.outer(np.linspace(0., 1., 8),
+                                                      theta[:3] / 360.)
+
+        monkeypatch.setattr(model.orbits, 'model', fake_model)
+        monkeypatch.setattr(model.orbits, 'models',
+                            lambda thetas: [fake_model(t) for t in thetas])
+
+        pspace = np.array([[-90., 90.],
+                           [90., 270.],
+                           [90., 270.],
+                           [.5, 6.],
+                           [1e-4, 2e-4]])
+        thetas = np.array([[10., 180., 180., .94, 1.237e-4],
+                           [-10., 100., 200., 3., 1.1e-4],
+                           [20., 120., 150., 3., 1.5e-4],
+                           [0., 180., 180., 1.5, 1.1e-4],
+                           [0., 180., 180., 7., 1.1e-4]])
+
+        data = model.PPV_ORIGIN + 1e-4 * np.random.rand(10, 3)
+        whiten, log_norm = model.whitening(np.cov(data, rowvar=False))
+        data = model.prepare_data(data, whiten)
+
+        lnprobs = model.ln_prob_batch(thetas, data, pspace, whiten, log_norm)
+        expected = [model.ln_prob(t, data, pspace, whiten, log_norm)
+                    for t in thetas]
+
+        # finite likelihood, infinite likelihood, finite likelihood, failed
+        # prior and out of bounds walkers respectively
+        assert np.all(np.isfinite(lnprobs[[0, 2]]))
+        assert lnprobs[1, 1] == -np.inf
+        assert np.all(lnprobs[3:] == -np.inf)
+        np.testing.assert_array_equal(lnprobs, expected)